@@ -0,0 +1,198 @@
+import numpy as np
+import pandas as pd
+from factor_engine import build_close_matrix, pool_cache_key
+
+# 默认回归窗口 (交易日) 与通道宽度 (残差标准差倍数)
+CHANNEL_WINDOW = 60
+BAND_SIGMA = 2.0
+
+# 常驻的通道引擎：(资产池, 窗口) -> 引擎及其已消费到的各标的 K 线位置，新 K 线只做增量追加
+_BOOKS = {}
+# 同一份行情 (最新 K 线日期 + 最新收盘价) 的计算结果，同一次运行内多次调用直接复用
+_RESULT_CACHE = {}
+
+
+class RollingChannel:
+    """
+    滚动线性回归通道。
+    维护 y, t*y, y^2 的累计和 (t 为全局 bar 序号)，窗口内 Σx, Σx² 为常数，
+    任意窗口的 Σy / Σxy / Σy² 都是两次累计和相减，每根新 K 线只需 O(1) 更新。
+    输入为 (bar x 标的) 矩阵，所有标的、所有 bar 一次向量化算完。
+    """
+    def __init__(self, window=CHANNEL_WINDOW):
+        self.window = window
+        self.n_bars = 0
+        self.ref = None    # 每列的参考价，先减去再累加，避免 Σy² 数值抵消
+        self.cum = None    # shape (3, 容量, 标的): Σy, Σty, Σy² 的前缀和，按倍增扩容
+
+    def extend(self, values):
+        """
+        追加若干根 K 线
+        :param values: ndarray，shape (bar, 标的) 或 (标的,)
+        """
+        values = np.atleast_2d(np.asarray(values, dtype=float))
+        if self.ref is None:
+            self.ref = values[0].copy()
+            self.cum = np.zeros((3, len(values) + 1, values.shape[1]))
+        needed = self.n_bars + len(values) + 1
+        if needed > self.cum.shape[1]:
+            grown = np.zeros((3, max(needed, 2 * self.cum.shape[1]), self.cum.shape[2]))
+            grown[:, :self.n_bars + 1] = self.cum[:, :self.n_bars + 1]
+            self.cum = grown
+        y = values - self.ref
+        t = np.arange(self.n_bars, self.n_bars + len(y), dtype=float)[:, None]
+        new = np.stack([y, t * y, y * y])
+        end = self.n_bars + len(y)
+        self.cum[:, self.n_bars + 1:end + 1] = self.cum[:, self.n_bars:self.n_bars + 1] + np.cumsum(new, axis=1)
+        self.n_bars = end
+        return self
+
+    def replace_last(self, values):
+        """盘中最新一根 K 线的价格会变：只重算最后一个前缀和，O(1)"""
+        y = np.asarray(values, dtype=float) - self.ref
+        t = float(self.n_bars - 1)
+        self.cum[:, self.n_bars] = self.cum[:, self.n_bars - 1] + np.stack([y, t * y, y * y])
+        return self
+
+    def stats(self, window=None, tail=None):
+        """
+        每根 K 线截至当前的窗口回归结果 (前 window-1 根为 NaN)
+        :param tail: 只计算最后 tail 根 K 线 (增量场景下每次只需最新结果)
+        :return: slope, intercept (窗口首根 x=0 处), resid_std，均为 (bar, 标的)
+        """
+        w = window or self.window
+        n_cols = self.cum.shape[2]
+        n_out = self.n_bars if tail is None else min(tail, self.n_bars)
+        shape = (n_out, n_cols)
+        slope, intercept, resid_std = (np.full(shape, np.nan) for _ in range(3))
+        if self.n_bars < w or w < 2: return slope, intercept, resid_std
+
+        # 参与计算的窗口终点：第 first_end 根 ~ 第 n_bars 根 (1 基)
+        first_end = max(w, self.n_bars - n_out + 1)
+        ends = np.arange(first_end, self.n_bars + 1)
+        cum = self.cum
+        sums = cum[:, ends] - cum[:, ends - w]              # 各窗口的 Σy, Σty, Σy²
+        sy, sty, syy = sums
+        start = (ends - w).astype(float)[:, None]
+        sxy = sty - start * sy                              # 换算成窗口内相对 x 的 Σxy
+        sx = w * (w - 1) / 2.0
+        sxx_c = w * (w * w - 1) / 12.0                      # Σ(x - x̄)²
+        sxy_c = sxy - sx * sy / w
+        syy_c = syy - sy * sy / w
+
+        b = sxy_c / sxx_c
+        a = (sy - b * sx) / w
+        sse = np.clip(syy_c - b * sxy_c, 0.0, None)
+
+        offset = n_out - len(ends)
+        slope[offset:] = b
+        intercept[offset:] = a + self.ref
+        resid_std[offset:] = np.sqrt(sse / w)
+        return slope, intercept, resid_std
+
+
+def fit_series(series, band_sigma=BAND_SIGMA):
+    """
+    用整段序列拟合一条回归通道 (绘图用)
+    :return: (中轴, 上轨, 下轨) ndarray；数据不足返回 (None, None, None)
+    """
+    y = np.asarray(series, dtype=float)
+    if len(y) < 2 or np.isnan(y).any(): return None, None, None
+    slope, intercept, resid_std = RollingChannel(len(y)).extend(y[:, None]).stats()
+    b, a, s = slope[-1, 0], intercept[-1, 0], resid_std[-1, 0]
+    reg_line = a + b * np.arange(len(y))
+    return reg_line, reg_line + band_sigma * s, reg_line - band_sigma * s
+
+
+def _own_bars(pool):
+    """{symbol: 只含该标的自身交易日的收盘价 Series} (不做跨市场前向填充)"""
+    raw = build_close_matrix(pool, ffill=False)
+    return {s: raw[s].dropna() for s in raw.columns}
+
+
+def _right_aligned(own, columns, n_rows):
+    """按各自 K 线右对齐成 (bar x 标的) 矩阵；历史较短的标的用首个价格补齐开头"""
+    matrix = np.empty((n_rows, len(columns)))
+    for j, s in enumerate(columns):
+        v = own[s].values[-n_rows:]
+        matrix[n_rows - len(v):, j] = v
+        matrix[:n_rows - len(v), j] = v[0]
+    return matrix
+
+
+def _sync_book(own, window):
+    """
+    让常驻引擎追上最新行情：
+    各标的新增 K 线数相同 (含 0) 时，先用最终价覆盖旧的最后一根，再追加新 K 线；
+    否则 (某市场假期 / 历史被修订) 整体重建。
+    """
+    columns = tuple(own)
+    key = (columns, window)
+    book = _BOOKS.get(key)
+    counts = {s: len(own[s]) for s in columns}
+
+    if book is not None:
+        new = {counts[s] - book['counts'][s] for s in columns}
+        consistent = len(new) == 1 and min(new) >= 0 and all(
+            own[s].index[book['counts'][s] - 1] == book['last_dates'][s] for s in columns
+        )
+        if consistent:
+            k = new.pop()
+            engine = book['engine']
+            engine.replace_last([own[s].iloc[book['counts'][s] - 1] for s in columns])
+            if k: engine.extend(np.array([own[s].values[-k:] for s in columns]).T)
+        else:
+            book = None
+
+    if book is None:
+        engine = RollingChannel(window).extend(_right_aligned(own, columns, max(counts.values())))
+
+    _BOOKS[key] = {
+        'engine': engine,
+        'counts': counts,
+        'last_dates': {s: own[s].index[-1] for s in columns},
+    }
+    return engine, counts
+
+
+def compute_breakouts(own, window=CHANNEL_WINDOW, band_sigma=BAND_SIGMA):
+    """
+    通道突破信号：用前 window 根 K 线的通道外推到当前 bar，与收盘价比较
+    :param own: {symbol: 自身交易日收盘价 Series}
+    :return: DataFrame，index 为标的，列为 中轴 / 上下轨 / σ位置 / 日斜率% / 信号
+    """
+    columns = list(own)
+    engine, counts = _sync_book(own, window)
+    slope, intercept, resid_std = engine.stats(tail=2)
+    # 上一根 bar 拟合的窗口，x=window 即当前 bar
+    b, a, s = slope[0], intercept[0], resid_std[0]
+    last = np.array([own[c].iloc[-1] for c in columns])
+    center = a + b * window
+    # 自身 K 线不足 window+1 根的标的，窗口里含补齐的价格，不给信号
+    enough = np.array([counts[c] > window for c in columns])
+    position = np.where(enough & (s > 0), (last - center) / np.where(s > 0, s, 1.0), np.nan)
+
+    result = pd.DataFrame({
+        'center': center,
+        'upper': center + band_sigma * s,
+        'lower': center - band_sigma * s,
+        'position': position,
+        'slope_pct': b / center * 100,
+    }, index=columns)
+    signal = np.select(
+        [position > band_sigma, position < -band_sigma], ['breakout_up', 'breakout_down'], default='inside'
+    ).astype(object)
+    signal[np.isnan(position)] = None
+    result['signal'] = pd.Series(signal, index=columns, dtype=object)
+    return result
+
+
+def get_breakouts(df_dict, window=CHANNEL_WINDOW):
+    """入口：同一份行情只计算一次；行情更新时常驻引擎增量追加"""
+    pool_key, pool = pool_cache_key(df_dict)
+    if pool_key is None: return pd.DataFrame()
+    key = (pool_key, window)
+    if key not in _RESULT_CACHE:
+        _RESULT_CACHE.clear()
+        _RESULT_CACHE[key] = compute_breakouts(_own_bars(pool), window)
+    return _RESULT_CACHE[key]
@@ -45,6 +45,42 @@ def init_db():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        # --- 每次运行的个股快照 (只追加)，(symbol, ts) 聚簇主键，ts 为 Unix 秒 ---
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS stock_history (
+                symbol TEXT NOT NULL,
+                ts INTEGER NOT NULL,
+                level INTEGER,
+                price REAL,
+                change_pct REAL,
+                anomaly_score REAL,
+                momentum REAL,
+                factor_score REAL,
+                channel_pos REAL,
+                left_signal INTEGER,
+                right_signal INTEGER,
+                PRIMARY KEY (symbol, ts)
+            ) WITHOUT ROWID
+        ''')
+        # 跨标的的时间范围查询 (如“今天等级上升的标的”) 走这个索引
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_stock_history_ts ON stock_history (ts)')
+        # --- 邮件发件箱：分析阶段只负责入队，投递阶段负责发送/重试 ---
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS email_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                dedupe_key TEXT UNIQUE,
+                sender TEXT,
+                recipients TEXT,
+                subject TEXT,
+                body TEXT,
+                status TEXT DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                last_error TEXT,
+                next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sent_at TIMESTAMP
+            )
+        ''')
         conn.execute('''
             CREATE TABLE IF NOT EXISTS system_logs (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -80,6 +116,35 @@ def mark_daily_task_done(task_key, date_str):
             ON CONFLICT(task_key, date_str) DO UPDATE SET completed=1
         ''', (task_key, date_str))
 
+# --- 调度状态批量读写 (health.plan_tasks 使用) ---
+def load_schedule_state(meta_keys, date_str):
+    """一次查询取回调度相关的 meta 值和当天已完成的定时任务"""
+    placeholders = ', '.join('?' * len(meta_keys))
+    with get_connection() as conn:
+        cursor = conn.execute(f'''
+            SELECT 'meta' AS kind, key, value FROM system_meta WHERE key IN ({placeholders})
+            UNION ALL
+            SELECT 'task' AS kind, task_key, completed FROM daily_tasks WHERE date_str = ? AND completed = 1
+        ''', (*meta_keys, date_str))
+        meta, done = {}, set()
+        for row in cursor.fetchall():
+            if row['kind'] == 'meta': meta[row['key']] = row['value']
+            else: done.add(row['key'])
+        return meta, done
+
+def save_schedule_state(meta_updates, done_tasks, date_str):
+    """本次运行产生的所有调度状态变更在同一个事务里写入"""
+    if not meta_updates and not done_tasks: return
+    with get_connection() as conn:
+        conn.executemany('''
+            INSERT INTO system_meta (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value=excluded.value, updated_at=CURRENT_TIMESTAMP
+        ''', [(k, str(v)) for k, v in meta_updates.items()])
+        conn.executemany('''
+            INSERT INTO daily_tasks (task_key, date_str, completed) VALUES (?, ?, 1)
+            ON CONFLICT(task_key, date_str) DO UPDATE SET completed=1
+        ''', [(k, date_str) for k in done_tasks])
+
 # --- 新闻去重逻辑 ---
 def is_news_sent(link):
     import hashlib
@@ -116,4 +181,116 @@ def update_stock_state(symbol, date, level, price, vol_score):
 
 def log_system_run(status, message):
     with get_connection() as conn:
-        conn.execute('INSERT INTO system_logs (status, message) VALUES (?, ?)', (status, message))
\ No newline at end of file
+        conn.execute('INSERT INTO system_logs (status, message) VALUES (?, ?)', (status, message))
+
+# --- 邮件发件箱 ---
+def enqueue_email(dedupe_key, sender, recipients, subject, body):
+    """
+    入队一封已渲染好的邮件；相同 dedupe_key 只会入队一次，返回是否为新邮件。
+    此前已放弃 (failed) 的同一封邮件会用新正文重新排队。
+    """
+    with get_connection() as conn:
+        cursor = conn.execute('''
+            INSERT INTO email_outbox (dedupe_key, sender, recipients, subject, body)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(dedupe_key) DO UPDATE SET
+                sender = excluded.sender, recipients = excluded.recipients,
+                subject = excluded.subject, body = excluded.body,
+                status = 'pending', attempts = 0, last_error = NULL,
+                next_attempt_at = CURRENT_TIMESTAMP, created_at = CURRENT_TIMESTAMP
+            WHERE email_outbox.status = 'failed'
+        ''', (dedupe_key, sender, recipients, subject, body))
+        return cursor.rowcount > 0
+
+def get_due_emails():
+    with get_connection() as conn:
+        cursor = conn.execute('''
+            SELECT * FROM email_outbox
+            WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+            ORDER BY id
+        ''')
+        return [dict(row) for row in cursor.fetchall()]
+
+def mark_email_sent(email_id):
+    # 发送成功后清空正文 (含内嵌图片)，只保留去重记录，避免 quant_state.db 膨胀
+    with get_connection() as conn:
+        conn.execute('''
+            UPDATE email_outbox SET status='sent', body=NULL, sent_at=CURRENT_TIMESTAMP, last_error=NULL
+            WHERE id = ?
+        ''', (email_id,))
+
+def mark_email_failed(email_id, error, retry_in_seconds, give_up_after_seconds):
+    # 入队超过 give_up_after_seconds 仍未发出才标记为 failed；正文保留，可用 requeue_failed_emails 重新投递
+    with get_connection() as conn:
+        conn.execute('''
+            UPDATE email_outbox SET
+                attempts = attempts + 1,
+                last_error = ?,
+                next_attempt_at = datetime('now', ?),
+                status = CASE WHEN created_at <= datetime('now', ?) THEN 'failed' ELSE 'pending' END
+            WHERE id = ?
+        ''', (str(error)[:500], f'+{int(retry_in_seconds)} seconds', f'-{int(give_up_after_seconds)} seconds', email_id))
+
+def requeue_failed_emails():
+    """把所有 failed 邮件重新放回队列 (重新计算重试时间窗)，返回条数"""
+    with get_connection() as conn:
+        cursor = conn.execute('''
+            UPDATE email_outbox SET
+                status = 'pending', attempts = 0,
+                next_attempt_at = CURRENT_TIMESTAMP, created_at = CURRENT_TIMESTAMP
+            WHERE status = 'failed' AND body IS NOT NULL
+        ''')
+        return cursor.rowcount
+
+# --- 个股历史快照 ---
+HISTORY_COLUMNS = (
+    'symbol', 'ts', 'level', 'price', 'change_pct', 'anomaly_score',
+    'momentum', 'factor_score', 'channel_pos', 'left_signal', 'right_signal'
+)
+
+def record_snapshots(rows):
+    """一次运行的所有快照在同一个事务里批量写入；rows 为按 HISTORY_COLUMNS 排列的元组"""
+    if not rows: return
+    placeholders = ', '.join('?' * len(HISTORY_COLUMNS))
+    with get_connection() as conn:
+        conn.executemany(
+            f"INSERT OR IGNORE INTO stock_history ({', '.join(HISTORY_COLUMNS)}) VALUES ({placeholders})",
+            rows
+        )
+
+def get_symbol_history(symbol, start_ts, end_ts=None, columns=('level', 'price', 'anomaly_score')):
+    """单个标的在 [start_ts, end_ts] 内的快照，按时间升序；走 (symbol, ts) 主键范围扫描"""
+    cols = [c for c in columns if c in HISTORY_COLUMNS]
+    with get_connection() as conn:
+        cursor = conn.execute(
+            f"SELECT ts, {', '.join(cols)} FROM stock_history WHERE symbol = ? AND ts >= ? AND ts <= ? ORDER BY ts",
+            (symbol, int(start_ts), int(end_ts if end_ts is not None else 2 ** 62))
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+def get_level_history(symbol, days=90, now_ts=None):
+    """最近 N 天的异动等级历史"""
+    now_ts = int(now_ts if now_ts is not None else datetime.now().timestamp())
+    return get_symbol_history(symbol, now_ts - days * 86400, now_ts, columns=('level',))
+
+def get_level_risers(since_ts):
+    """
+    since_ts 之后最新等级高于 since_ts 之前最后一次等级的标的 (如“今天等级上升”)
+    since_ts 之前没有记录的标的 (历史第一天 / 新加入的标的) 无从比较，不算上升
+    今日部分走 ts 索引，之前的等级按 (symbol, ts) 主键倒序取 1 行
+    """
+    with get_connection() as conn:
+        cursor = conn.execute('''
+            SELECT symbol, level, prev_level FROM (
+                SELECT symbol, level, MAX(ts) AS ts,
+                    (SELECT p.level FROM stock_history p
+                     WHERE p.symbol = h.symbol AND p.ts < :since
+                     ORDER BY p.ts DESC LIMIT 1) AS prev_level
+                FROM stock_history h INDEXED BY idx_stock_history_ts
+                WHERE ts >= :since
+                GROUP BY symbol
+            )
+            WHERE prev_level IS NOT NULL AND level > prev_level
+            ORDER BY level DESC, symbol
+        ''', {'since': int(since_ts)})
+        return [dict(row) for row in cursor.fetchall()]
@@ -0,0 +1,122 @@
+import pandas as pd
+import numpy as np
+
+# 多周期动量回看窗口 (交易日)
+MOMENTUM_LOOKBACKS = (20, 60, 120)
+VOL_WINDOW = 20
+REVERSAL_WINDOW = 5
+N_BUCKETS = 10
+
+# 按行情快照缓存计算结果，同一份行情内所有调用方共享一次计算
+_FACTOR_CACHE = {}
+
+
+def build_close_matrix(df_dict, ffill=True):
+    """
+    把各标的收盘价对齐成一个 (日期 x 标的) 矩阵。
+    伦敦/纽约标的的 yfinance 索引时区不同，统一按本地交易日对齐，缺失日默认向前填充。
+    """
+    series = {}
+    for symbol, df in df_dict.items():
+        if df is None or df.empty: continue
+        closes = df['Close']
+        idx = closes.index
+        if getattr(idx, 'tz', None) is not None:
+            idx = idx.tz_localize(None)
+        idx = idx.normalize()
+        keep = ~idx.duplicated(keep='last')
+        series[symbol] = pd.Series(closes.values[keep], index=idx[keep])
+    if not series: return pd.DataFrame()
+    closes = pd.DataFrame(series).sort_index()
+    return closes.ffill() if ffill else closes
+
+
+def build_bar_matrix(df_dict):
+    """
+    按各标的自己的 K 线右对齐成 (bar x 标的) 矩阵：最后一行是每个标的最新一根 K 线，
+    往上第 n 行是它自己的前 n 根 K 线。伦敦/纽约假期不会插入填充的 0 收益，
+    回看窗口也按各自的交易日计数。
+    """
+    columns = build_close_matrix(df_dict, ffill=False)
+    if columns.empty: return columns
+    values = [columns[s].dropna().values for s in columns.columns]
+    n_bars = max(len(v) for v in values)
+    matrix = np.full((n_bars, len(values)), np.nan)
+    for j, v in enumerate(values):
+        if len(v): matrix[n_bars - len(v):, j] = v
+    return pd.DataFrame(matrix, columns=columns.columns)
+
+
+def _zscore(values):
+    std = values.std()
+    if not std or np.isnan(std): return values * 0.0
+    return (values - values.mean()) / std
+
+
+def compute_factors(closes):
+    """
+    对整个资产池一次性矩阵计算因子。
+    :param closes: build_bar_matrix 的输出 (按各标的自身 K 线右对齐)
+    :return: DataFrame，index 为标的，列为因子值 / z-score / 排名 / 分位桶
+    """
+    returns = closes.pct_change(fill_method=None)
+    last = closes.iloc[-1]
+    factors = pd.DataFrame(index=closes.columns)
+
+    # 1. 多周期动量：区间收益率
+    for lb in MOMENTUM_LOOKBACKS:
+        if len(closes) > lb:
+            factors[f'mom_{lb}'] = last / closes.iloc[-1 - lb] - 1
+        else:
+            factors[f'mom_{lb}'] = np.nan
+
+    # 2. 波动率：近 20 日日收益率标准差
+    recent = returns.iloc[-VOL_WINDOW:]
+    factors['vol_20'] = recent.std().where(recent.count() >= VOL_WINDOW)
+
+    # 3. 均值回归：短期反转 + 偏离 20 日均线的标准差倍数
+    if len(closes) > REVERSAL_WINDOW:
+        factors['reversal_5'] = -(last / closes.iloc[-1 - REVERSAL_WINDOW] - 1)
+    else:
+        factors['reversal_5'] = np.nan
+    window = closes.iloc[-VOL_WINDOW:]
+    factors['mr_dev_20'] = (last - window.mean()) / window.std().replace(0, np.nan)
+
+    # 4. 横截面 z-score，综合动量分 = 各周期经波动率调整后动量 z 的均值
+    for col in list(factors.columns):
+        factors[f'z_{col}'] = _zscore(factors[col])
+    risk_adj = pd.concat(
+        [_zscore(factors[f'mom_{lb}'] / factors['vol_20']) for lb in MOMENTUM_LOOKBACKS], axis=1
+    )
+    factors['composite'] = risk_adj.mean(axis=1, skipna=False)
+
+    # 5. 排名 (1 为最强) 与分位桶 (10 为最强)
+    valid = factors['composite'].dropna()
+    factors['rank'] = valid.rank(ascending=False, method='first')
+    n_buckets = min(N_BUCKETS, len(valid))
+    if n_buckets > 0:
+        pct = valid.rank(method='first') / len(valid)
+        factors['bucket'] = np.ceil(pct * n_buckets).clip(1, n_buckets)
+    else:
+        factors['bucket'] = np.nan
+    return factors.sort_values('composite', ascending=False, na_position='last')
+
+
+def pool_cache_key(df_dict):
+    """
+    各标的 (最新 K 线时间, 最新收盘价) 作为缓存键，不必先构建矩阵。
+    守护进程盘中刷新时最新一根 K 线的价格会变，只按日期做键会一直沿用首次运行的结果。
+    """
+    pool = {s: df for s, df in df_dict.items() if df is not None and not df.empty}
+    if not pool: return None, pool
+    return tuple(sorted((s, df.index[-1], float(df['Close'].iloc[-1])) for s, df in pool.items())), pool
+
+
+def get_factor_table(df_dict):
+    """带缓存的入口：同一份行情只计算一次"""
+    key, pool = pool_cache_key(df_dict)
+    if key is None: return pd.DataFrame()
+    if key not in _FACTOR_CACHE:
+        _FACTOR_CACHE.clear()
+        _FACTOR_CACHE[key] = compute_factors(build_bar_matrix(pool))
+    return _FACTOR_CACHE[key]
@@ -19,71 +19,131 @@ SCHEDULED_TIMES = [
     (time(16, 0), "收盘总结 (16:00)")
 ]
 
+# 相对时间里程碑: (Key, 运行满多少秒, 报告标题)
+RELATIVE_MILESTONES = [
+    (KEY_SENT_20MIN, 1200, "⏱️ 运行满20分钟测试报告"),
+    (KEY_SENT_1HOUR, 3600, "⏱️ 运行满1小时测试报告"),
+    (KEY_SENT_3HOUR, 10800, "⏱️ 运行满3小时测试报告"),
+]
+
 TIMEZONE = pytz.timezone('US/Eastern')
 
-def get_pending_tasks():
+def _sched_key(target_time):
+    return f"SCHED_{target_time.strftime('%H%M')}"
+
+def _next_weekend_hour(now):
+    """下一个周末整点 (心跳只在周末发送)"""
+    nxt = (now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)).replace(tzinfo=None)
+    if nxt.weekday() < 5:
+        nxt = datetime.combine(nxt.date() + timedelta(days=5 - nxt.weekday()), time(0, 0))
+    return TIMEZONE.localize(nxt)
+
+def plan_tasks(now=None):
     """
-    检查所有时间表，返回需要执行的任务列表
+    一次读取全部调度状态，算出：当前到期的任务、需要写回的状态、下一个任务的到期时间。
+    本函数不写库也不打印，写库和日志见 get_pending_tasks。
+    :return: dict(tasks, meta_updates, done_tasks, date_str, next_due, logs)
     """
-    tasks = []
-    now = datetime.now(TIMEZONE)
+    now = now or datetime.now(TIMEZONE)
     today_str = now.strftime('%Y-%m-%d')
-    
+    meta_keys = [KEY_START_TIME, KEY_SENT_STARTUP] + [k for k, _, _ in RELATIVE_MILESTONES]
+    meta, done = db.load_schedule_state(meta_keys, today_str)
+
+    tasks = []
+    meta_updates = {}
+    done_tasks = []
+    candidates = []
+    logs = []
+
     # --- 1. 相对时间检查 (系统启动后的关键测试节点) ---
-    start_time_str = db.get_meta(KEY_START_TIME)
-    
+    start_time_str = meta.get(KEY_START_TIME)
+    start_time = None
+
     if not start_time_str:
         # 第一次运行：记录启动时间并触发初始化报告
-        db.set_meta(KEY_START_TIME, now.isoformat())
+        start_time = now
+        meta_updates[KEY_START_TIME] = now.isoformat()
         tasks.append(("REPORT_ALL", "🚀 系统启动初始化报告"))
-        db.set_meta(KEY_SENT_STARTUP, "1")
-        print(f"DEBUG: 数据库已初始化，启动时间设为: {now.isoformat()}")
+        meta_updates[KEY_SENT_STARTUP] = "1"
+        logs.append(f"DEBUG: 数据库已初始化，启动时间设为: {now.isoformat()}")
     else:
         # 计算已运行时长
         try:
             start_time = datetime.fromisoformat(start_time_str)
             if start_time.tzinfo is None:
                 start_time = TIMEZONE.localize(start_time)
-            
+
             uptime = (now - start_time).total_seconds()
-            print(f"DEBUG: 系统已运行 {int(uptime)} 秒")
-
-            # 20分钟报告 (1200秒) - 增加追补逻辑：只要时间到了且没发过，必发
-            if uptime >= 1200 and not db.get_meta(KEY_SENT_20MIN):
-                tasks.append(("REPORT_ALL", "⏱️ 运行满20分钟测试报告"))
-                db.set_meta(KEY_SENT_20MIN, "1")
-                
-            # 1小时报告 (3600秒)
-            if uptime >= 3600 and not db.get_meta(KEY_SENT_1HOUR):
-                tasks.append(("REPORT_ALL", "⏱️ 运行满1小时测试报告"))
-                db.set_meta(KEY_SENT_1HOUR, "1")
-                
-            # 3小时报告 (10800秒)
-            if uptime >= 10800 and not db.get_meta(KEY_SENT_3HOUR):
-                tasks.append(("REPORT_ALL", "⏱️ 运行满3小时测试报告"))
-                db.set_meta(KEY_SENT_3HOUR, "1")
+            logs.append(f"DEBUG: 系统已运行 {int(uptime)} 秒")
+
+            # 增加追补逻辑：只要时间到了且没发过，必发
+            for key, seconds, label in RELATIVE_MILESTONES:
+                if meta.get(key): continue
+                if uptime >= seconds:
+                    tasks.append(("REPORT_ALL", label))
+                    meta_updates[key] = "1"
         except Exception as e:
-            print(f"DEBUG: 解析启动时间失败: {e}")
+            start_time = None
+            logs.append(f"DEBUG: 解析启动时间失败: {e}")
+
+    if start_time is not None:
+        for key, seconds, _ in RELATIVE_MILESTONES:
+            if not meta.get(key) and key not in meta_updates:
+                candidates.append(start_time + timedelta(seconds=seconds))
 
     # --- 2. 绝对时间检查 (日常定时任务) ---
     for target_time, label in SCHEDULED_TIMES:
         target_dt = TIMEZONE.localize(datetime.combine(now.date(), target_time))
-        
+        task_key = _sched_key(target_time)
+        if task_key in done: continue
+
         # 只要当前时间超过了目标时间，且今天还没发过，就执行
         # 这样即使 GitHub Actions 延迟了半小时启动，它也会补发刚才错过的报告
         if now >= target_dt:
-            task_key = f"SCHED_{target_time.strftime('%H%M')}"
-            if not db.check_daily_task_done(task_key, today_str):
-                tasks.append(("REPORT_ALL", f"⏰ {label}"))
-                db.mark_daily_task_done(task_key, today_str)
+            tasks.append(("REPORT_ALL", f"⏰ {label}"))
+            done_tasks.append(task_key)
+        else:
+            candidates.append(target_dt)
+    # 明天的第一个定时任务兜底
+    first_time = min(t for t, _ in SCHEDULED_TIMES)
+    candidates.append(TIMEZONE.localize(datetime.combine(now.date() + timedelta(days=1), first_time)))
 
     # --- 3. 周末/非交易时段的心跳包 (每隔1小时强制运行一次作为存活证明) ---
     # 这能解决你“休市期间不敢信它还在工作”的疑虑
     heartbeat_key = f"HEARTBEAT_{now.hour}"
-    if not db.check_daily_task_done(heartbeat_key, today_str):
+    if heartbeat_key not in done:
         # 仅在非交易日且没有其他任务时作为备份发送
         if not tasks and now.weekday() >= 5:
             tasks.append(("REPORT_ALL", f"💓 系统周末心跳检查 ({now.strftime('%H:00')})"))
-            db.mark_daily_task_done(heartbeat_key, today_str)
+            done_tasks.append(heartbeat_key)
+    candidates.append(_next_weekend_hour(now))
+
+    return {
+        "tasks": tasks,
+        "meta_updates": meta_updates,
+        "done_tasks": done_tasks,
+        "date_str": today_str,
+        # 已有到期任务时下一次到期就是现在
+        "next_due": now if tasks else min(candidates),
+        "logs": logs,
+    }
 
-    return tasks
\ No newline at end of file
+def get_pending_tasks(now=None):
+    """
+    检查所有时间表，返回需要执行的任务列表，并把完成状态一次性写回
+    """
+    plan = plan_tasks(now)
+    for line in plan['logs']: print(line)
+    db.save_schedule_state(plan['meta_updates'], plan['done_tasks'], plan['date_str'])
+    return plan['tasks']
+
+def get_next_due_time(now=None):
+    """下一个报告任务的到期时间 (只读，不改变任何状态)"""
+    return plan_tasks(now)['next_due']
+
+if __name__ == "__main__":
+    # 供 workflow / 守护进程查询：打印下一次到期时间和需要等待的秒数
+    db.init_db()
+    now = datetime.now(TIMEZONE)
+    next_due = get_next_due_time(now)
+    print(f"{next_due.isoformat()} {max(0, int((next_due - now).total_seconds()))}")
@@ -0,0 +1,70 @@
+import os
+import sys
+import smtplib
+import db
+
+# SMTP 配置 (默认 Gmail SSL；本地测试可指向 aiosmtpd 等替身: SMTP_HOST=127.0.0.1 SMTP_PORT=8025 SMTP_SSL=0)
+SMTP_HOST = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', 465))
+SMTP_USE_SSL = os.environ.get('SMTP_SSL', '1') != '0'
+SMTP_TIMEOUT = 30
+
+# 重试策略：失败后按 60s, 120s, 240s ... 退避 (最长 1 小时一次)，入队 24 小时仍未发出才标记为 failed
+# 重试只在 cron / 守护进程运行时发生，按时间窗而不是次数放弃，邮箱服务中断几个小时也不会丢报告
+RETRY_WINDOW_SECONDS = int(os.environ.get('MAIL_RETRY_WINDOW_SECONDS', 24 * 3600))
+BACKOFF_BASE_SECONDS = 60
+BACKOFF_MAX_SECONDS = 3600
+
+
+def _connect(user, password):
+    smtp_cls = smtplib.SMTP_SSL if SMTP_USE_SSL else smtplib.SMTP
+    conn = smtp_cls(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+    if user and password:
+        conn.login(user, password)
+    return conn
+
+
+def deliver_outbox():
+    """
+    投递阶段：取出所有到期的待发邮件，复用同一个 SMTP 连接逐封发送。
+    返回 (成功数, 失败数)
+    """
+    emails = db.get_due_emails()
+    if not emails: return 0, 0
+
+    user, password = os.environ.get('MAIL_USER'), os.environ.get('MAIL_PASS')
+    sent, failed = 0, 0
+    conn = None
+    try:
+        for email in emails:
+            try:
+                if conn is None:
+                    conn = _connect(user, password)
+                conn.sendmail(email['sender'], email['recipients'].split(','), email['body'])
+                db.mark_email_sent(email['id'])
+                sent += 1
+            except Exception as e:
+                print(f"SMTP Error: {e}")
+                backoff = min(BACKOFF_BASE_SECONDS * (2 ** min(email['attempts'], 16)), BACKOFF_MAX_SECONDS)
+                db.mark_email_failed(email['id'], e, backoff, RETRY_WINDOW_SECONDS)
+                failed += 1
+                # 连接可能已失效，下一封重新建连
+                if conn is not None:
+                    try: conn.close()
+                    except: pass
+                    conn = None
+    finally:
+        if conn is not None:
+            try: conn.quit()
+            except: pass
+
+    print(f"📮 发件箱投递: 成功 {sent} 封, 失败 {failed} 封")
+    return sent, failed
+
+
+if __name__ == "__main__":
+    db.init_db()
+    # python mailer.py --requeue: 把已放弃的邮件重新放回队列后立即投递
+    if '--requeue' in sys.argv[1:]:
+        print(f"📮 重新排队 {db.requeue_failed_emails()} 封已放弃的邮件")
+    deliver_outbox()
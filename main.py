@@ -1,21 +1,22 @@
 import yfinance as yf
 import pandas as pd
 import pytz
-from datetime import datetime, time
+from datetime import datetime, time, timedelta
 import db
 import os
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.image import MIMEImage
-from email.header import Header
+import sys
+import time as time_mod
+import hashlib
 import numpy as np
 import ai
 import health
+import mailer
 import plotter
+import report
 import traceback
-from technical import TechnicalAnalyzer
+from technical import TechnicalAnalyzer, SIGNAL_SCORES
 from quant_engine import QuantEngine 
+from scheduler import RunScheduler
 
 # --- 1. 核心配置与资产池 ---
 STOCKS = [
@@ -25,6 +26,10 @@ STOCKS = [
 ]
 TIMEZONE = pytz.timezone('US/Eastern')
 
+# 常驻模式：盘中刷新间隔与最短睡眠 (秒)
+INTRADAY_POLL_SECONDS = 20 * 60
+MIN_SLEEP_SECONDS = 60
+
 def is_trading_time():
     now = datetime.now(TIMEZONE)
     if now.weekday() >= 5: return 0, "周末休市"
@@ -50,134 +55,33 @@ def determine_level(score):
     if score >= 2.0: return 1
     return 0
 
-# --- 2. 邮件 HTML 生成器 (找回所有量化组件) ---
+# --- 2. 报告入队 (渲染见 report.py) ---
 
-def generate_stock_html(data):
-    symbol = data['symbol']
-    pct = data['change_pct']
-    color = "red" if pct < 0 else "green"
-    
-    # [零件1归位] 技术面数据解析
-    tech = data.get('tech_analysis') or {}
-    signals = tech.get('signals') or {}
-    setup = tech.get('trade_setup') or {}
-    indicators = tech.get('indicators') or {}
-    
-    l_tag, l_act, l_desc = signals.get('left_side', ('-', '-', '-'))
-    r_tag, r_act, r_desc = signals.get('right_side', ('-', '-', '-'))
-    
-    # [零件2归位] 统计套利 (Pairs Trading) 紫色框
+def build_snapshot(data, ts):
+    """把一个标的的分析结果压成 stock_history 的一行 (顺序同 db.HISTORY_COLUMNS)"""
+    signals = (data.get('tech_analysis') or {}).get('signals') or {}
     quant = data.get('quant_analysis') or {}
-    pair_info = quant.get('pair_trade')
-    pair_html = ""
-    if pair_info and abs(pair_info['z_score']) > 1.5:
-        p_color = "#6f42c1" # 紫色
-        pair_html = f"""
-        <div style="margin: 10px 0; border-left: 4px solid {p_color}; background: #f3f0ff; padding: 10px; font-size: 12px;">
-            <b style="color:{p_color};">🔗 统计套利提醒 (Pairs):</b><br/>
-            检测到与 <b>{pair_info['pair_symbol']}</b> 强相关 (Corr: {pair_info['correlation']})<br/>
-            Spread Z-Score: <b>{pair_info['z_score']}</b> → 建议: <b>{"做空本股/多对家" if pair_info['z_score']>0 else "做多本股/空对家"}</b>
-        </div>
-        """
-
-    # [零件3归位] 做市商挂单 (Market Making) 细节
-    mm_info = quant.get('market_making')
-    mm_html = ""
-    if mm_info:
-        mm_html = f"""
-        <div style="display:flex; justify-content:space-between; margin-top:5px; font-size:11px; color:#555; border-top:1px dashed #eee; padding-top:5px;">
-            <span>📉 挂单接盘: <b>${mm_info['limit_buy']}</b></span>
-            <span>📈 挂单抛售: <b>${mm_info['limit_sell']}</b></span>
-        </div>
-        """
-
-    def get_tag_color(tag):
-        if "极端" in tag: return "#ff4d4f"
-        if "中性" in tag: return "#faad14"
-        return "#8c8c8c"
-
-    chart_html = f'<div style="text-align:center; margin:15px 0;"><img src="cid:{data["chart_cid"]}" style="width:100%;max-width:650px;border:1px solid #ddd;border-radius:4px;"></div>' if data['chart_path'] else ""
-
-    return f"""
-    <div style="border:1px solid #e8e8e8; padding:20px; margin-bottom:30px; border-radius:10px; font-family:Arial; background:#fff;">
-        <div style="display:flex; justify-content:space-between; align-items:center; border-bottom:3px solid {color}; padding-bottom:5px;">
-            <h2 style="margin:0;">{symbol}</h2>
-            <div style="text-align:right;">
-                <span style="font-size:20px; font-weight:bold; color:{color};">{pct:+.2f}%</span>
-                <div style="font-size:10px; color:#999;">TSMOM Score: {quant.get('momentum', 0)}</div>
-            </div>
-        </div>
-
-        {pair_html}
-
-        <div style="display:flex; justify-content:space-around; background:#f9f9f9; padding:6px; margin-top:10px; font-size:11px; border-radius:4px;">
-            <span>RSI: {indicators.get('rsi', '-')}</span>
-            <span>布林位置: {indicators.get('bb_pos', 0):.1f}%</span>
-            <span>MACD: {indicators.get('macd', '-')}</span>
-        </div>
-
-        <div style="margin-top:15px;">
-            <table style="width:100%; border-collapse:collapse; font-size:12px;">
-                <tr style="background:#fafafa;"><th style="padding:8px; border:1px solid #eee;">🐻 左侧 (逆势)</th><th style="padding:8px; border:1px solid #eee;">🐂 右侧 (顺势)</th></tr>
-                <tr>
-                    <td style="padding:10px; border:1px solid #eee; vertical-align:top;">
-                        <span style="background:{get_tag_color(l_tag)}; color:white; padding:1px 4px; border-radius:3px;">{l_tag}</span><br/>
-                        <b>{l_act}</b><br/><small>{l_desc}</small>
-                        <div style="margin-top:8px; padding:5px; background:#e6f7ff; color:#003a8c; font-style:italic;">🤖 {data.get('ai_left', '-')}</div>
-                    </td>
-                    <td style="padding:10px; border:1px solid #eee; vertical-align:top;">
-                        <span style="background:{get_tag_color(r_tag)}; color:white; padding:1px 4px; border-radius:3px;">{r_tag}</span><br/>
-                        <b>{r_act}</b><br/><small>{r_desc}</small>
-                        <div style="margin-top:8px; padding:5px; background:#e6f7ff; color:#003a8c; font-style:italic;">🤖 {data.get('ai_right', '-')}</div>
-                    </td>
-                </tr>
-            </table>
-        </div>
-
-        <div style="margin-top:15px; background:#f6ffed; border:1px solid #b7eb8f; padding:10px; border-radius:5px; color:#135200; font-size:13px;">
-            <b>🛒 加仓参考: ${setup.get('buy_target_price', 0)}</b> ({setup.get('buy_desc', '-')})
-            {mm_html}
-        </div>
-        <div style="margin-top:5px; background:#fff5f5; border:1px solid #ffccc7; padding:10px; border-radius:5px; color:#a8071a; font-size:13px;">
-            <b>🛡️ 止损建议: ${setup.get('stop_loss_price', 0)}</b> (参考: {setup.get('support_desc', '-')})
-        </div>
-
-        {chart_html}
-
-        <div style="margin-top:10px; border-top:1px dashed #eee; padding-top:8px; font-size:11px; color:#666;">
-            <b>📰 摘要:</b> {data.get('ai_summary', '-')}
-        </div>
-    </div>
-    """
-
-# --- 3. SMTP 及核心逻辑 ---
-
-def attach_image(msg, path, cid):
-    try:
-        with open(path, 'rb') as f:
-            img = MIMEImage(f.read())
-            img.add_header('Content-ID', f'<{cid}>')
-            img.add_header('Content-Disposition', 'inline', filename=os.path.basename(path))
-            msg.attach(img)
-    except: pass
-
-def send_summary_report(data_list, reason):
-    sender, password, receiver = os.environ.get('MAIL_USER'), os.environ.get('MAIL_PASS'), os.environ.get('MAIL_RECEIVER')
+    factor = quant.get('factor') or {}
+    ch = quant.get('channel') or {}
+    left = signals.get('left_side', ('-', '-', '-'))[1]
+    right = signals.get('right_side', ('-', '-', '-'))[1]
+    return (
+        data['symbol'], ts, data['level'], float(data['price']), float(data['change_pct']),
+        float(data['score']), float(quant.get('momentum') or 0), factor.get('composite'),
+        ch.get('position'), SIGNAL_SCORES.get(left), SIGNAL_SCORES.get(right)
+    )
+
+def enqueue_summary_report(data_list, reason, sections=None):
+    """渲染报告并写入发件箱，由投递阶段 (mailer.deliver_outbox) 负责发送"""
+    sender, receiver = os.environ.get('MAIL_USER'), os.environ.get('MAIL_RECEIVER')
     if not sender or not data_list: return
-    msg = MIMEMultipart('related')
-    msg['Subject'] = Header(f"{reason} | QuantBot V6.4 FINAL", 'utf-8')
-    msg['From'], msg['To'] = sender, receiver
-    html = f"<html><body style='background:#f4f7f9; padding:20px;'><h1 style='text-align:center;'>{reason}</h1>"
-    for d in data_list: html += generate_stock_html(d)
-    html += "</body></html>"
-    msg.attach(MIMEText(html, 'html', 'utf-8'))
-    for d in data_list:
-        if d['chart_path']: attach_image(msg, d['chart_path'], d['chart_cid'])
-    try:
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as s:
-            s.login(sender, password)
-            s.sendmail(sender, receiver.split(','), msg.as_string())
-    except Exception as e: print(f"SMTP Error: {e}")
+    subject = f"{reason} | QuantBot V6.4 FINAL"
+    msg = report.build_report_message(data_list, reason, subject, sender, receiver, sections)
+    # 同一天同一任务只入队一次，重复运行不会重复发信
+    today_str = datetime.now(TIMEZONE).strftime('%Y-%m-%d')
+    dedupe_key = hashlib.sha256(f"{today_str}|{reason}|{receiver}".encode('utf-8')).hexdigest()
+    if not db.enqueue_email(dedupe_key, sender, receiver, subject, msg.as_string()):
+        print(f"📮 报告已在发件箱中，跳过: {reason}")
 
 def run_monitor():
     db.init_db()
@@ -197,6 +101,7 @@ def run_monitor():
     if status_code == 0 and not force_report_reason: return
 
     print(f"🚀 开始全量量化分析... 任务: {force_report_reason}")
+    scheduler = RunScheduler()
     
     # [零件4归位] 构建数据池供 QuantEngine 使用
     df_pool = {}
@@ -208,6 +113,7 @@ def run_monitor():
     
     qe = QuantEngine(df_pool)
 
+    # 第一轮：所有标的先跑廉价阶段 (TA + 量化)，保证报告覆盖全部资产
     for symbol in STOCKS:
         if symbol not in df_pool: continue
         try:
@@ -216,38 +122,108 @@ def run_monitor():
             ta = TechnicalAnalyzer(df)
             tech_res = ta.analyze()
             score, pct = calculate_anomaly_score(symbol, curr_price, df)
+            level = determine_level(score)
             
             # [零件5归位] 完整量化计算
             data = {
                 'symbol': symbol, 'price': curr_price, 'change_pct': pct,
+                'score': score, 'level': level,
                 'tech_analysis': tech_res,
                 'quant_analysis': {
                     "pair_trade": qe.find_pair_opportunity(symbol),
                     "market_making": qe.get_optimal_limit_levels(symbol),
-                    "momentum": qe.get_momentum_score(symbol)
+                    "momentum": qe.get_momentum_score(symbol),
+                    "factor": qe.get_factor_profile(symbol),
+                    "channel": qe.get_channel_signal(symbol)
                 },
-                'chart_path': plotter.generate_chart(symbol),
-                'chart_cid': f"chart_{symbol}_{datetime.now().microsecond}"
+                'chart_path': None,
+                'chart_cid': f"chart_{symbol}_{datetime.now().microsecond}",
+                'degraded': []
             }
-            
-            # AI 分析与异常处理
-            try:
-                news = ai.get_latest_news(symbol)
-                ai_res = ai.analyze_market_move(symbol, pct, news, tech_res)
-                data['ai_summary'] = ai_res.get('summary', '-')
-                data['ai_left'] = ai_res.get('left_side_analysis', '-')
-                data['ai_right'] = ai_res.get('right_side_analysis', '-')
-            except: pass
 
             report_data_list.append(data)
             # [零件6归位] 完整状态记录
-            db.update_stock_state(symbol, datetime.now(TIMEZONE).strftime('%Y-%m-%d'), determine_level(score), curr_price, score)
+            db.update_stock_state(symbol, datetime.now(TIMEZONE).strftime('%Y-%m-%d'), level, curr_price, score)
         except: traceback.print_exc()
 
+    # 第二轮：按异动优先级跑昂贵阶段 (图表 / 新闻 / LLM)，预算耗尽则降级
+    for data in scheduler.prioritize(report_data_list):
+        symbol = data['symbol']
+        # 只剩保底时间：剩余标的全部降级，不再逐阶段判断
+        if scheduler.expired():
+            data['degraded'].extend(['chart', 'news', 'llm'])
+            continue
+        try:
+            if scheduler.can_afford('chart'):
+                with scheduler.track('chart'):
+                    data['chart_path'] = plotter.generate_chart(symbol)
+            else:
+                data['degraded'].append('chart')
+
+            # 新闻一旦拉取就会被标记为已发送，所以必须确保 LLM 也来得及跑
+            if scheduler.can_afford('news', 'llm'):
+                # AI 分析与异常处理
+                try:
+                    with scheduler.track('news'):
+                        news = ai.get_latest_news(symbol)
+                    with scheduler.track('llm'):
+                        ai_res = ai.analyze_market_move(symbol, data['change_pct'], news, data['tech_analysis'])
+                    data['ai_summary'] = ai_res.get('summary', '-')
+                    data['ai_left'] = ai_res.get('left_side_analysis', '-')
+                    data['ai_right'] = ai_res.get('right_side_analysis', '-')
+                except: pass
+            else:
+                data['degraded'].extend(['news', 'llm'])
+        except: traceback.print_exc()
+
+    # 本次运行的所有快照一次性追加写入历史表
+    try:
+        snapshot_ts = int(datetime.now(TIMEZONE).timestamp())
+        db.record_snapshots([build_snapshot(d, snapshot_ts) for d in report_data_list])
+    except: traceback.print_exc()
+
+    degraded = [d['symbol'] for d in report_data_list if d['degraded']]
+    print(f"⏳ 调度器: {scheduler.summary()}，降级标的: {degraded or '无'}")
+
     if force_report_reason and report_data_list:
-        send_summary_report(report_data_list, force_report_reason)
+        # 按异动优先级排列，体积超预算时优先丢弃靠后标的的图表
+        sections = []
+        try: sections.append(("横截面排行榜", report.generate_leaderboard_html(qe.get_factor_table())))
+        except: traceback.print_exc()
+        try: sections.append(("组合风险", report.generate_risk_html(qe.get_portfolio_risk())))
+        except: traceback.print_exc()
+        enqueue_summary_report(scheduler.prioritize(report_data_list), force_report_reason, sections)
     
     db.log_system_run("SUCCESS", "V6.4 All Systems Functional")
 
+def run_once():
+    try: run_monitor()
+    except: traceback.print_exc()
+    # 投递阶段与分析解耦：分析失败也会尝试补发此前积压的报告
+    try: mailer.deliver_outbox()
+    except: traceback.print_exc()
+
+def run_daemon():
+    """
+    常驻模式：每次运行后直接睡到下一个报告任务的到期时间，而不是固定轮询。
+    盘中仍按 INTRADAY_POLL_SECONDS 刷新个股状态。
+    """
+    while True:
+        run_once()
+        now = datetime.now(TIMEZONE)
+        try: next_due = health.get_next_due_time(now)
+        except:
+            traceback.print_exc()
+            next_due = now + timedelta(seconds=INTRADAY_POLL_SECONDS)
+        wait = (next_due - now).total_seconds()
+        if is_trading_time()[0] == 2:
+            wait = min(wait, INTRADAY_POLL_SECONDS)
+        wait = max(wait, MIN_SLEEP_SECONDS)
+        print(f"😴 下次运行: {(now + timedelta(seconds=wait)).isoformat()} (等待 {int(wait)}s)")
+        time_mod.sleep(wait)
+
 if __name__ == "__main__":
-    run_monitor()
\ No newline at end of file
+    if '--daemon' in sys.argv[1:]:
+        run_daemon()
+    else:
+        run_once()
\ No newline at end of file
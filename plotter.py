@@ -3,19 +3,13 @@ matplotlib.use('Agg')
 import mplfinance as mpf
 import yfinance as yf
 import pandas as pd
-import numpy as np
 import os
-from scipy.stats import linregress
+import channel
 
 def calculate_regression(series):
+    # 回归通道由 channel 引擎计算 (累计和解析解，无需 scipy)
     try:
-        y = series.values
-        x = np.arange(len(y))
-        slope, intercept, _, _, _ = linregress(x, y)
-        reg_line = slope * x + intercept
-        residuals = y - reg_line
-        std_dev = np.std(residuals)
-        return reg_line, reg_line + (2 * std_dev), reg_line - (2 * std_dev)
+        return channel.fit_series(series.values)
     except:
         return None, None, None
 
@@ -1,6 +1,8 @@
 import pandas as pd
 import numpy as np
-from scipy.stats import linregress
+import factor_engine
+import channel
+import risk_model
 
 class QuantEngine:
     def __init__(self, df_dict):
@@ -8,6 +10,8 @@ class QuantEngine:
         :param df_dict: 一个字典，包含所有股票的 DataFrame, key 是 symbol
         """
         self.data_pool = df_dict
+        # 收益率 / 波动率 / 相关性统一由风险模型按 K 线日期计算一次
+        self.risk = risk_model.get_risk_model(df_dict)
 
     # --- 1. Statistical Arbitrage (Pairs Trading) ---
     def find_pair_opportunity(self, target_symbol):
@@ -17,34 +21,18 @@ class QuantEngine:
         target_df = self.data_pool.get(target_symbol)
         if target_df is None or len(target_df) < 60: return None
 
-        best_pair = None
-        highest_corr = 0
-        
-        # 1. 在资产池中寻找相关性最高的股票 (Correlation)
-        target_closes = target_df['Close'].iloc[-60:] # 观察过去60个交易日
-        
-        for symbol, df in self.data_pool.items():
-            if symbol == target_symbol: continue
-            
-            other_closes = df['Close'].iloc[-60:]
-            if len(other_closes) != len(target_closes): continue
-            
-            # 计算皮尔逊相关系数
-            corr = np.corrcoef(target_closes, other_closes)[0, 1]
-            if abs(corr) > abs(highest_corr):
-                highest_corr = corr
-                best_pair = symbol
+        # 1. 在资产池中寻找相关性最高的股票 (Correlation)，观察过去60个交易日
+        best_pair, highest_corr = self.risk.best_price_pair(target_symbol)
 
         # 如果相关性太低（小于0.8），判定为无有效对冲标的
         if abs(highest_corr) < 0.8: 
             return None
 
         # 2. 计算价差 (Spread) 和 Z-Score
-        pair_df = self.data_pool[best_pair]
-        # 对齐索引确保计算准确
-        common_idx = target_df.index.intersection(pair_df.index)
-        s1 = target_df.loc[common_idx]['Close']
-        s2 = pair_df.loc[common_idx]['Close']
+        # 使用风险模型中按交易日对齐的收盘价矩阵 (伦敦/纽约标的时区不同，直接取索引交集会为空)
+        aligned = self.risk.closes[[target_symbol, best_pair]].dropna()
+        s1 = aligned[target_symbol]
+        s2 = aligned[best_pair]
         
         ratio = s1 / s2
         mean = ratio.rolling(window=20).mean()
@@ -76,9 +64,9 @@ class QuantEngine:
         
         curr_price = df['Close'].iloc[-1]
         
-        # 计算日化波动率
-        returns = df['Close'].pct_change().dropna()
-        daily_vol = returns.std()
+        # 日化波动率 (来自风险模型)
+        daily_vol = self.risk.vol(symbol)
+        if daily_vol is None: return None
         
         # 风险调整项：波动率越大，挂单距离现价越远
         # 这里的简化逻辑是基于 1 倍日波动率作为散户做市的参考安全边际
@@ -106,13 +94,56 @@ class QuantEngine:
         past_price = closes.iloc[-lookback]
         curr_price = closes.iloc[-1]
         
-        returns = closes.pct_change()
-        vol = returns.rolling(window=lookback).std().iloc[-1]
+        vol = self.risk.vol(symbol, window=lookback)
         
-        if vol == 0 or np.isnan(vol): vol = 0.01
+        if not vol or np.isnan(vol): vol = 0.01
         
         # 动量得分 = 收益率 / 波动率
         raw_ret = (curr_price - past_price) / past_price
         score = raw_ret / vol
         
-        return round(score, 2)
\ No newline at end of file
+        return round(score, 2)
+
+    # --- 4. Cross-Sectional Factors ---
+    def get_factor_table(self):
+        """
+        全资产池横截面因子表 (多周期动量 / 波动率 / 均值回归, 含 z-score、排名、分位桶)
+        按 K 线日期缓存，多次调用只计算一次
+        """
+        return factor_engine.get_factor_table(self.data_pool)
+
+    def get_factor_profile(self, symbol):
+        """单个标的在横截面中的位置"""
+        table = self.get_factor_table()
+        if symbol not in table.index: return None
+        row = table.loc[symbol]
+        if np.isnan(row['rank']): return None
+        return {
+            "rank": int(row['rank']),
+            "universe": int(table['rank'].notna().sum()),
+            "bucket": int(row['bucket']),
+            "composite": round(row['composite'], 2)
+        }
+
+    # --- 5. Portfolio Risk ---
+    def get_portfolio_risk(self, weights=None):
+        """组合波动率 / VaR / 风险贡献，默认等权持有整个资产池"""
+        if self.risk is None: return None
+        return self.risk.portfolio_risk(weights)
+
+    # --- 6. Regression Channel Breakout ---
+    def get_channel_signal(self, symbol):
+        """
+        60日线性回归通道突破：当前收盘价相对前 60 日通道外推值的位置 (σ 倍数)
+        按各标的自身交易日拟合，整个资产池同一份行情只算一次
+        """
+        table = channel.get_breakouts(self.data_pool)
+        if symbol not in table.index or pd.isna(table.at[symbol, 'position']): return None
+        row = table.loc[symbol]
+        return {
+            "signal": row['signal'],
+            "position": round(row['position'], 2),
+            "upper": round(row['upper'], 2),
+            "lower": round(row['lower'], 2),
+            "slope_pct": round(row['slope_pct'], 3)
+        }
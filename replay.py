@@ -0,0 +1,270 @@
+"""
+录制 / 回放 run_monitor 的所有外部依赖，用于离线、可复现地计时和剖析整条流水线。
+
+    # 录制：正常访问 yfinance / Google News / LLM / SMTP，同时把响应存进夹具目录
+    python replay.py record --fixtures fixtures/run1
+
+    # 回放：全部由本地替身提供，时钟冻结在录制时刻，可注入延迟
+    python replay.py replay --fixtures fixtures/run1 --latency llm=1.5,rss=0.2 --profile run1.prof
+
+两种模式都使用夹具目录内的临时数据库，不会改动 quant_state.db。
+"""
+import os
+import io
+import sys
+import json
+import time
+import pickle
+import hashlib
+import argparse
+import cProfile
+import pstats
+from datetime import datetime
+
+import yfinance as yf
+import db
+import ai
+import health
+import mailer
+import main
+
+KINDS = ('prices', 'rss', 'llm', 'smtp')
+
+
+class ReplayMiss(KeyError):
+    """回放时找不到对应的录制响应"""
+
+
+def _key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False).encode('utf-8')).hexdigest()[:24]
+
+
+def parse_latency(spec):
+    """'0.2' 表示所有类型统一延迟；'llm=1.5,rss=0.2' 按类型配置"""
+    latency = {k: 0.0 for k in KINDS}
+    if not spec: return latency
+    for part in str(spec).split(','):
+        if '=' in part:
+            kind, value = part.split('=', 1)
+            if kind not in latency: raise ValueError(f"未知的延迟类型: {kind}")
+            latency[kind] = float(value)
+        else:
+            latency = {k: float(part) for k in KINDS}
+    return latency
+
+
+class FixtureStore:
+    def __init__(self, root, mode, latency=None):
+        self.root = root
+        self.mode = mode
+        self.latency = latency or parse_latency(None)
+        for kind in KINDS:
+            os.makedirs(os.path.join(root, kind), exist_ok=True)
+
+    def _path(self, kind, key, ext):
+        return os.path.join(self.root, kind, f"{key}.{ext}")
+
+    def save(self, kind, key, obj):
+        with open(self._path(kind, key, 'pkl'), 'wb') as f:
+            pickle.dump(obj, f)
+
+    def load(self, kind, key):
+        time.sleep(self.latency.get(kind, 0.0))
+        try:
+            with open(self._path(kind, key, 'pkl'), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            raise ReplayMiss(f"{kind}/{key}")
+
+    def save_message(self, sender, recipients, body):
+        name = f"{int(time.time() * 1000)}_{_key(sender, recipients, body)}.eml"
+        with open(os.path.join(self.root, 'smtp', name), 'w', encoding='utf-8') as f:
+            f.write(body)
+
+
+# --- 1. yfinance ---
+def _make_ticker(store, real_ticker):
+    class Ticker:
+        def __init__(self, symbol):
+            self.symbol = symbol
+
+        def history(self, *args, **kwargs):
+            key = _key(self.symbol, args, kwargs)
+            if store.mode == 'replay':
+                return store.load('prices', key)
+            df = real_ticker(self.symbol).history(*args, **kwargs)
+            store.save('prices', key, df)
+            return df
+    return Ticker
+
+
+# --- 2. Google News RSS ---
+class _Response:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+
+def _make_requests_get(store, real_get):
+    def get(url, *args, **kwargs):
+        key = _key(url)
+        if store.mode == 'replay':
+            status, content = store.load('rss', key)
+            return _Response(status, content)
+        resp = real_get(url, *args, **kwargs)
+        store.save('rss', key, (resp.status_code, resp.content))
+        return resp
+    return get
+
+
+# --- 3. LLM ---
+class _Message:
+    def __init__(self, content):
+        self.message = type('M', (), {'content': content})()
+
+
+def _make_openai(store, real_openai):
+    class Completions:
+        def __init__(self, real_client):
+            self.real_client = real_client
+
+        def create(self, **kwargs):
+            key = _key(kwargs.get('model'), kwargs.get('messages'))
+            if store.mode == 'replay':
+                content = store.load('llm', key)
+            else:
+                content = self.real_client.chat.completions.create(**kwargs).choices[0].message.content
+                store.save('llm', key, content)
+            return type('R', (), {'choices': [_Message(content)]})()
+
+    class OpenAI:
+        def __init__(self, **kwargs):
+            real_client = real_openai(**kwargs) if store.mode == 'record' else None
+            self.chat = type('C', (), {'completions': Completions(real_client)})()
+    return OpenAI
+
+
+# --- 4. SMTP ---
+class _LocalSMTP:
+    """回放用的 SMTP 替身，把邮件写进夹具目录的 smtp/replayed"""
+    def __init__(self, store):
+        self.store = store
+
+    def sendmail(self, sender, recipients, body):
+        time.sleep(self.store.latency.get('smtp', 0.0))
+        path = os.path.join(self.store.root, 'smtp', 'replayed')
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, f"{_key(sender, recipients, body)}.eml"), 'w', encoding='utf-8') as f:
+            f.write(body)
+        return {}
+
+    def quit(self): pass
+
+    def close(self): pass
+
+
+class _RecordingSMTP:
+    def __init__(self, store, conn):
+        self.store, self.conn = store, conn
+
+    def sendmail(self, sender, recipients, body):
+        result = self.conn.sendmail(sender, recipients, body)
+        self.store.save_message(sender, recipients, body)
+        return result
+
+    def quit(self): return self.conn.quit()
+
+    def close(self): return self.conn.close()
+
+
+def _make_smtp_connect(store, real_connect):
+    def connect(user, password):
+        if store.mode == 'replay':
+            time.sleep(store.latency.get('smtp', 0.0))
+            return _LocalSMTP(store)
+        return _RecordingSMTP(store, real_connect(user, password))
+    return connect
+
+
+# --- 5. 冻结时钟 ---
+def _make_frozen_datetime(frozen):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            if tz is None: return frozen.astimezone().replace(tzinfo=None)
+            return frozen.astimezone(tz)
+    return FrozenDatetime
+
+
+def install(mode, fixture_dir, latency=None, frozen_now=None):
+    """
+    打补丁接管所有外部依赖
+    :param mode: record / replay
+    :param frozen_now: 冻结的当前时间 (带时区的 datetime)，None 表示使用真实时钟
+    """
+    store = FixtureStore(fixture_dir, mode, latency)
+    yf.Ticker = _make_ticker(store, yf.Ticker)
+    ai.requests.get = _make_requests_get(store, ai.requests.get)
+    ai.OpenAI = _make_openai(store, ai.OpenAI)
+    mailer._connect = _make_smtp_connect(store, mailer._connect)
+    if frozen_now is not None:
+        frozen_cls = _make_frozen_datetime(frozen_now)
+        health.datetime = frozen_cls
+        main.datetime = frozen_cls
+
+    # 独立的临时数据库：保证每次回放的调度状态 / 新闻去重都从同一起点开始
+    db.DB_NAME = os.path.join(fixture_dir, 'replay_state.db')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db.DB_NAME + suffix): os.remove(db.DB_NAME + suffix)
+
+    if mode == 'replay':
+        # 录制时有 LLM / 邮件响应就照样走完这些分支
+        if os.listdir(os.path.join(fixture_dir, 'llm')) and not ai.LLM_API_KEY:
+            ai.LLM_API_KEY = 'replay'
+        os.environ.setdefault('MAIL_USER', 'replay@localhost')
+        os.environ.setdefault('MAIL_RECEIVER', 'replay@localhost')
+    return store
+
+
+def run_pipeline():
+    main.run_monitor()
+    mailer.deliver_outbox()
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="录制 / 回放 run_monitor 全流程")
+    parser.add_argument('mode', choices=['record', 'replay'])
+    parser.add_argument('--fixtures', required=True, help="夹具目录")
+    parser.add_argument('--latency', default=None, help="回放注入延迟 (秒)，如 0.2 或 llm=1.5,rss=0.2")
+    parser.add_argument('--now', default=None, help="冻结时钟 (ISO 格式，带时区)；回放默认使用录制时刻")
+    parser.add_argument('--profile', default=None, help="cProfile 输出文件")
+    args = parser.parse_args(argv)
+
+    manifest_path = os.path.join(args.fixtures, 'manifest.json')
+    if args.mode == 'record':
+        frozen = datetime.fromisoformat(args.now) if args.now else datetime.now(health.TIMEZONE)
+        os.makedirs(args.fixtures, exist_ok=True)
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump({"frozen_now": frozen.isoformat(), "stocks": main.STOCKS}, f, ensure_ascii=False, indent=2)
+    else:
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        frozen = datetime.fromisoformat(args.now or manifest['frozen_now'])
+
+    install(args.mode, args.fixtures, parse_latency(args.latency), frozen)
+
+    start = time.perf_counter()
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.runcall(run_pipeline)
+        profiler.dump_stats(args.profile)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(20)
+        print(out.getvalue())
+    else:
+        run_pipeline()
+    print(f"⏱️ [{args.mode}] 全流程耗时 {time.perf_counter() - start:.2f}s (时钟冻结于 {frozen.isoformat()})")
+
+
+if __name__ == "__main__":
+    main_cli(sys.argv[1:])
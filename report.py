@@ -0,0 +1,442 @@
+import os
+import io
+import hashlib
+import pandas as pd
+import numpy as np
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.mime.image import MIMEImage
+from email.header import Header
+from PIL import Image
+from scheduler import STAGE_LABELS
+
+# 整封邮件的体积预算 (字节，按最终 MIME 报文计算)；Gmail 上限 25MB，留足余量
+REPORT_BYTE_BUDGET = int(os.environ.get('REPORT_BYTE_BUDGET', 5 * 1024 * 1024))
+
+# 排行榜展示前后各 N 名，资产池很大时不至于撑爆邮件
+LEADERBOARD_SIZE = 10
+
+# 图片压缩阶梯 (最大宽度, JPEG 质量)，超预算时逐级降低
+# 卡片里图片的显示宽度上限就是 650px，再大也是浪费
+IMAGE_LADDER = [(650, 80), (560, 65), (460, 50)]
+
+# MIME 报文的固定开销估计：信封头部 + 正文部分头部 + 边界，以及每张内嵌图片子部分的头部
+MESSAGE_OVERHEAD = 1024
+IMAGE_PART_OVERHEAD = 300
+
+# 所有卡片共用的样式，统一放进一个 <style>，不再在每张卡片里重复内联
+REPORT_CSS = """
+body{background:#f4f7f9;padding:20px;}
+h1{text-align:center;}
+.card{border:1px solid #e8e8e8;padding:20px;margin-bottom:30px;border-radius:10px;font-family:Arial;background:#fff;}
+.head{display:flex;justify-content:space-between;align-items:center;border-bottom:3px solid;padding-bottom:5px;}
+.head h2{margin:0;}
+.head-up{border-bottom-color:green;}.head-down{border-bottom-color:red;}
+.pct{font-size:20px;font-weight:bold;}
+.pct-up{color:green;}.pct-down{color:red;}
+.r{text-align:right;}
+.sub{font-size:10px;color:#999;}
+.note{margin:10px 0;padding:10px;font-size:12px;}
+.pair{border-left:4px solid #6f42c1;background:#f3f0ff;}
+.pair .t{color:#6f42c1;}
+.degraded{border-left:4px solid #fa8c16;background:#fff7e6;color:#ad4e00;}
+.indi{display:flex;justify-content:space-around;background:#f9f9f9;padding:6px;margin-top:10px;font-size:11px;border-radius:4px;}
+.sig{width:100%;border-collapse:collapse;font-size:12px;margin-top:15px;}
+.sig th{padding:8px;border:1px solid #eee;background:#fafafa;}
+.sig td{padding:10px;border:1px solid #eee;vertical-align:top;}
+.tag{color:white;padding:1px 4px;border-radius:3px;}
+.tag-extreme{background:#ff4d4f;}.tag-neutral{background:#faad14;}.tag-idle{background:#8c8c8c;}
+.ai{margin-top:8px;padding:5px;background:#e6f7ff;color:#003a8c;font-style:italic;}
+.box{padding:10px;border-radius:5px;font-size:13px;}
+.buy{margin-top:15px;background:#f6ffed;border:1px solid #b7eb8f;color:#135200;}
+.stop{margin-top:5px;background:#fff5f5;border:1px solid #ffccc7;color:#a8071a;}
+.mm{display:flex;justify-content:space-between;margin-top:5px;font-size:11px;color:#555;border-top:1px dashed #eee;padding-top:5px;}
+.chart{text-align:center;margin:15px 0;}
+.chart img{width:100%;max-width:650px;border:1px solid #ddd;border-radius:4px;}
+.summary{margin-top:10px;border-top:1px dashed #eee;padding-top:8px;font-size:11px;color:#666;}
+.board{width:100%;border-collapse:collapse;font-size:12px;}
+.board th{padding:6px;border-bottom:2px solid #ddd;text-align:right;background:#fafafa;}
+.board td{padding:5px 6px;border-bottom:1px solid #eee;text-align:right;}
+.board td.s,.board th.s{text-align:left;}
+.board .sep td{text-align:center;color:#999;}
+.mt{margin-top:10px;}
+.sizes{font-size:10px;color:#999;border-collapse:collapse;margin:0 auto;}
+.sizes td{padding:2px 8px;border-bottom:1px solid #eee;}
+"""
+
+
+def _b64_size(n):
+    """n 字节经 MIME base64 编码后的字节数 (含每 76 字符一个换行)"""
+    b = (n + 2) // 3 * 4
+    return b + (b + 75) // 76
+
+
+def _fmt_bytes(n):
+    return f"{n / 1024:.1f} KB" if n < 1024 * 1024 else f"{n / 1024 / 1024:.2f} MB"
+
+
+def get_tag_class(tag):
+    if "极端" in tag: return "tag-extreme"
+    if "中性" in tag: return "tag-neutral"
+    return "tag-idle"
+
+
+def generate_stock_html(data):
+    symbol = data['symbol']
+    pct = data['change_pct']
+    direction = "down" if pct < 0 else "up"
+
+    # [零件1归位] 技术面数据解析
+    tech = data.get('tech_analysis') or {}
+    signals = tech.get('signals') or {}
+    setup = tech.get('trade_setup') or {}
+    indicators = tech.get('indicators') or {}
+
+    l_tag, l_act, l_desc = signals.get('left_side', ('-', '-', '-'))
+    r_tag, r_act, r_desc = signals.get('right_side', ('-', '-', '-'))
+
+    # [零件2归位] 统计套利 (Pairs Trading) 紫色框
+    quant = data.get('quant_analysis') or {}
+    pair_info = quant.get('pair_trade')
+    pair_html = ""
+    if pair_info and abs(pair_info['z_score']) > 1.5:
+        pair_html = f"""
+        <div class="note pair">
+            <b class="t">🔗 统计套利提醒 (Pairs):</b><br/>
+            检测到与 <b>{pair_info['pair_symbol']}</b> 强相关 (Corr: {pair_info['correlation']})<br/>
+            Spread Z-Score: <b>{pair_info['z_score']}</b> → 建议: <b>{"做空本股/多对家" if pair_info['z_score']>0 else "做多本股/空对家"}</b>
+        </div>
+        """
+
+    # [零件3归位] 做市商挂单 (Market Making) 细节
+    mm_info = quant.get('market_making')
+    mm_html = ""
+    if mm_info:
+        mm_html = f"""
+        <div class="mm">
+            <span>📉 挂单接盘: <b>${mm_info['limit_buy']}</b></span>
+            <span>📈 挂单抛售: <b>${mm_info['limit_sell']}</b></span>
+        </div>
+        """
+
+    # 横截面排名
+    factor = quant.get('factor')
+    factor_html = ""
+    if factor:
+        factor_html = f'<div class="sub">横截面排名: #{factor["rank"]}/{factor["universe"]} (D{factor["bucket"]})</div>'
+
+    # 回归通道突破
+    ch = quant.get('channel')
+    channel_html = ""
+    if ch:
+        label = {"breakout_up": "🚀 突破通道上轨", "breakout_down": "🕳️ 跌破通道下轨"}.get(ch['signal'], "通道内运行")
+        channel_html = f"""
+        <div class="mm">
+            <span>📐 60日回归通道: <b>{label}</b> (σ位置 {ch['position']:+.2f})</span>
+            <span>通道 ${ch['lower']} ~ ${ch['upper']} · 日斜率 {ch['slope_pct']:+.3f}%</span>
+        </div>
+        """
+
+    # 时间预算 / 体积预算不足时被跳过的阶段
+    degraded = data.get('degraded') or []
+    degraded_html = ""
+    if degraded:
+        skipped = " / ".join(STAGE_LABELS.get(s, s) for s in degraded)
+        degraded_html = f"""
+        <div class="note degraded">
+            ⏳ <b>降级输出:</b> 本次运行预算不足，已跳过 {skipped}
+        </div>
+        """
+
+    chart_html = f'<div class="chart"><img src="cid:{data["chart_cid"]}"></div>' if data['chart_path'] else ""
+
+    return f"""
+    <div class="card">
+        <div class="head head-{direction}">
+            <h2>{symbol}</h2>
+            <div class="r">
+                <span class="pct pct-{direction}">{pct:+.2f}%</span>
+                <div class="sub">TSMOM Score: {quant.get('momentum', 0)}</div>
+                {factor_html}
+            </div>
+        </div>
+
+        {degraded_html}
+        {pair_html}
+
+        <div class="indi">
+            <span>RSI: {indicators.get('rsi', '-')}</span>
+            <span>布林位置: {indicators.get('bb_pos', 0):.1f}%</span>
+            <span>MACD: {indicators.get('macd', '-')}</span>
+        </div>
+
+        <table class="sig">
+            <tr><th>🐻 左侧 (逆势)</th><th>🐂 右侧 (顺势)</th></tr>
+            <tr>
+                <td>
+                    <span class="tag {get_tag_class(l_tag)}">{l_tag}</span><br/>
+                    <b>{l_act}</b><br/><small>{l_desc}</small>
+                    <div class="ai">🤖 {data.get('ai_left', '-')}</div>
+                </td>
+                <td>
+                    <span class="tag {get_tag_class(r_tag)}">{r_tag}</span><br/>
+                    <b>{r_act}</b><br/><small>{r_desc}</small>
+                    <div class="ai">🤖 {data.get('ai_right', '-')}</div>
+                </td>
+            </tr>
+        </table>
+
+        <div class="box buy">
+            <b>🛒 加仓参考: ${setup.get('buy_target_price', 0)}</b> ({setup.get('buy_desc', '-')})
+            {mm_html}
+            {channel_html}
+        </div>
+        <div class="box stop">
+            <b>🛡️ 止损建议: ${setup.get('stop_loss_price', 0)}</b> (参考: {setup.get('support_desc', '-')})
+        </div>
+
+        {chart_html}
+
+        <div class="summary">
+            <b>📰 摘要:</b> {data.get('ai_summary', '-')}
+        </div>
+    </div>
+    """
+
+
+def _pct(v, sign=True, digits=1):
+    return "-" if pd.isna(v) else (f"{v * 100:+.{digits}f}%" if sign else f"{v * 100:.{digits}f}%")
+
+
+def _num(v, digits=2):
+    return "-" if pd.isna(v) else f"{v:.{digits}f}"
+
+
+def generate_leaderboard_html(table, size=LEADERBOARD_SIZE):
+    """横截面动量排行榜区块 (table 为 factor_engine.compute_factors 的输出)"""
+    if table.empty: return ""
+    ranked = table[table['rank'].notna()].sort_values('rank')
+    if ranked.empty: return ""
+
+    def row_html(symbol, r):
+        return (
+            f"<tr><td class='s'>#{int(r['rank'])} <b>{symbol}</b></td><td>D{int(r['bucket'])}</td>"
+            f"<td>{_num(r['composite'])}</td><td>{_pct(r['mom_20'])}</td><td>{_pct(r['mom_60'])}</td>"
+            f"<td>{_pct(r['mom_120'])}</td><td>{_pct(r['vol_20'], sign=False)}</td><td>{_num(r['mr_dev_20'], 1)}</td></tr>"
+        )
+
+    if len(ranked) > 2 * size:
+        rows = [row_html(s, r) for s, r in ranked.head(size).iterrows()]
+        rows.append(f"<tr class='sep'><td colspan='8'>… 省略 {len(ranked) - 2 * size} 个标的 …</td></tr>")
+        rows += [row_html(s, r) for s, r in ranked.tail(size).iterrows()]
+    else:
+        rows = [row_html(s, r) for s, r in ranked.iterrows()]
+
+    return "".join([
+        "<div class='card'><h2>🏆 横截面动量排行榜</h2><table class='board'>",
+        "<tr><th class='s'>标的</th><th>分位</th><th>综合分</th><th>20日</th><th>60日</th>",
+        "<th>120日</th><th>日波动</th><th>MA20偏离σ</th></tr>",
+        *rows,
+        "</table></div>",
+    ])
+
+
+def generate_risk_html(risk, top_n=5):
+    """组合风险区块 (risk 为 QuantEngine.get_portfolio_risk 的输出)"""
+    if not risk: return ""
+    contrib = risk['contributions']
+    total = contrib.sum()
+    rows = [
+        f"<tr><td class='s'><b>{symbol}</b></td><td>{_pct(c, sign=False, digits=3)}</td><td>{_pct(c / total if total else np.nan, sign=False)}</td></tr>"
+        for symbol, c in contrib.head(top_n).items()
+    ]
+    return "".join([
+        "<div class='card'><h2>🛡️ 组合风险 (等权资产池)</h2>",
+        f"<div class='indi'><span>日波动: <b>{_pct(risk['volatility'], sign=False, digits=2)}</b></span>",
+        f"<span>VaR95 参数法: <b>{_pct(risk['var_95_param'], sign=False, digits=2)}</b></span>",
+        f"<span>VaR95 历史法: <b>{_pct(risk['var_95_hist'], sign=False, digits=2)}</b></span>",
+        f"<span>平均相关: <b>{_num(risk['avg_correlation'])}</b></span></div>",
+        f"<table class='board mt'><tr><th class='s'>风险贡献 Top {top_n}</th><th>贡献</th><th>占比</th></tr>",
+        *rows,
+        f"</table><div class='sub'>协方差估计: {risk['method']}</div></div>",
+    ])
+
+
+def compress_image(path, max_width, quality):
+    """将图表重编码为 JPEG 并按宽度等比缩放，失败返回 None"""
+    try:
+        with Image.open(path) as img:
+            img = img.convert('RGB')
+            if img.width > max_width:
+                img = img.resize((max_width, round(img.height * max_width / img.width)), Image.LANCZOS)
+            buf = io.BytesIO()
+            img.save(buf, format='JPEG', quality=quality, optimize=True, progressive=True)
+            return buf.getvalue()
+    except Exception as e:
+        print(f"⚠️ 图片压缩失败 {path}: {e}")
+        return None
+
+
+def _encode_charts(data_list, max_width, quality):
+    """按图片内容哈希去重，返回 {symbol: (sha, bytes)}"""
+    encoded = {}
+    for d in data_list:
+        if not d['chart_path']: continue
+        img_bytes = compress_image(d['chart_path'], max_width, quality)
+        if img_bytes is None: continue
+        encoded[d['symbol']] = (hashlib.sha256(img_bytes).hexdigest(), img_bytes)
+    return encoded
+
+
+def _size_row(name, n):
+    return f"<tr><td>{name}</td><td>{_fmt_bytes(n)}</td></tr>"
+
+
+# 页脚体积行按最长的数字格式记账 ("1024.0 KB")，实际渲染只会更短
+_ROW_PLACEHOLDER = 1024 * 1024 - 1
+
+
+class _ReportLayout:
+    """
+    报告装配的中间状态：当前保留的卡片 / 图表 / 附加区块，以及它们的体积。
+    体积增量维护，每一步削减只更新受影响的部分，资产池很大时也不会反复渲染整封邮件。
+    """
+    def __init__(self, data_list, encoded, sections, reason, budget):
+        self.reason, self.budget = reason, budget
+        self.kept = list(data_list)
+        self.omitted = []
+        self.sections = list(sections)
+        self.encoded = dict(encoded)
+        self.refs = {}       # 图片 sha -> 引用它的标的数；同图共用一个 cid
+        self.cids = {}
+        for sha, _ in self.encoded.values():
+            self.refs[sha] = self.refs.get(sha, 0) + 1
+        self.image_bytes = sum(_b64_size(len(b)) + IMAGE_PART_OVERHEAD for _, b in self._unique_images().items())
+
+        self.cards = {}
+        self.html_bytes = sum(len(p.encode('utf-8')) for p in self._frame(self._footer_head(0)))
+        for d in self.kept:
+            self.cards[d['symbol']] = self._render(d)
+            self.html_bytes += self.cards[d['symbol']][1] + self._row_bytes(d['symbol'])
+        for title, h in self.sections:
+            self.html_bytes += len(h.encode('utf-8')) + self._row_bytes(title)
+
+    def _render(self, d):
+        if d['symbol'] in self.encoded:
+            sha, _ = self.encoded[d['symbol']]
+            d['chart_cid'] = self.cids.setdefault(sha, f"chart_{sha[:16]}")
+        else:
+            d['chart_path'] = None
+        h = generate_stock_html(d)
+        return h, len(h.encode('utf-8'))
+
+    def _unique_images(self):
+        return {sha: b for sha, b in self.encoded.values()}
+
+    def _row_bytes(self, name):
+        return len(_size_row(name, _ROW_PLACEHOLDER).encode('utf-8'))
+
+    def _omitted_html(self):
+        if not self.omitted: return ""
+        return (f"<div class='card note degraded'>✂️ 报告体积超出预算，省略 {len(self.omitted)} 个低优先级标的: "
+                f"{', '.join(self.omitted)}</div>")
+
+    def _footer_head(self, total):
+        return (f"<tr><td colspan='2'>📦 报告体积 (约 {_fmt_bytes(total)} / 预算 {_fmt_bytes(self.budget)}, "
+                f"图片 {len(self.refs)} 张)</td></tr>")
+
+    def _frame(self, footer_head):
+        return (f"<html><head><meta charset='utf-8'><style>{REPORT_CSS}</style></head><body><h1>{self.reason}</h1>",
+                f"<table class='sizes'>{footer_head}", "</table></body></html>")
+
+    def estimate(self):
+        """整封 MIME 报文体积的估计值 (略偏保守)"""
+        html_bytes = self.html_bytes + len(self._omitted_html().encode('utf-8'))
+        return MESSAGE_OVERHEAD + _b64_size(html_bytes) + self.image_bytes
+
+    def _drop_image(self, symbol):
+        sha, img_bytes = self.encoded.pop(symbol)
+        self.refs[sha] -= 1
+        if not self.refs[sha]:
+            del self.refs[sha]
+            self.image_bytes -= _b64_size(len(img_bytes)) + IMAGE_PART_OVERHEAD
+
+    def shrink(self):
+        """
+        按优先级做一步削减：低优先级标的的图表 → 低优先级标的的卡片 (至少保留一张) → 附加区块 (从后往前)
+        已无可削减内容时返回 False
+        """
+        for d in reversed(self.kept):
+            if d['symbol'] in self.encoded:
+                self._drop_image(d['symbol'])
+                d['degraded'] = (d.get('degraded') or []) + ['chart']
+                old_bytes = self.cards[d['symbol']][1]
+                self.cards[d['symbol']] = self._render(d)
+                self.html_bytes += self.cards[d['symbol']][1] - old_bytes
+                return True
+        if len(self.kept) > 1:
+            symbol = self.kept.pop()['symbol']
+            self.html_bytes -= self.cards.pop(symbol)[1] + self._row_bytes(symbol)
+            self.omitted.insert(0, symbol)
+            return True
+        if self.sections:
+            title, h = self.sections.pop()
+            self.html_bytes -= len(h.encode('utf-8')) + self._row_bytes(title)
+            return True
+        return False
+
+    def message(self, subject, sender, receiver):
+        # 页脚各区块按编码后的体积列出 (HTML 与图片分别 base64)，与总量同一口径
+        rows = []
+        for d in self.kept:
+            card_bytes = _b64_size(self.cards[d['symbol']][1])
+            img = self.encoded.get(d['symbol'])
+            rows.append(_size_row(d['symbol'], card_bytes + (_b64_size(len(img[1])) if img else 0)))
+        rows += [_size_row(title, _b64_size(len(h.encode('utf-8')))) for title, h in self.sections]
+        head, footer, tail = self._frame(self._footer_head(self.estimate()))
+
+        html = "".join([
+            head,
+            *(self.cards[d['symbol']][0] for d in self.kept),
+            self._omitted_html(),
+            *(h for _, h in self.sections),
+            footer,
+            *rows,
+            tail,
+        ])
+        msg = MIMEMultipart('related')
+        msg['Subject'] = Header(subject, 'utf-8')
+        msg['From'], msg['To'] = sender, receiver
+        msg.attach(MIMEText(html, 'html', 'utf-8'))
+        for sha, img_bytes in self._unique_images().items():
+            img = MIMEImage(img_bytes, _subtype='jpeg')
+            img.add_header('Content-ID', f'<{self.cids[sha]}>')
+            img.add_header('Content-Disposition', 'inline', filename=f"{self.cids[sha]}.jpg")
+            msg.attach(img)
+        return msg
+
+
+def build_report_message(data_list, reason, subject, sender, receiver, sections=None, budget=REPORT_BYTE_BUDGET):
+    """
+    报告装配阶段：压缩并去重图表，在体积预算内装配 HTML + 内嵌图片。
+    预算针对整封 MIME 报文 (HTML、附加区块与图片均按 base64 编码后计算)，超预算时先逐级降低图片尺寸/质量，
+    仍超则按 _ReportLayout.shrink 的顺序丢弃内容 (data_list 已按重要性排列时效果最好)。
+    :param sections: 附加区块 [(标题, html)]，追加在个股卡片之后
+    :return: MIMEMultipart
+    """
+    sections = [(title, h) for title, h in (sections or []) if h]
+
+    # 1. 图片：按压缩阶梯找到第一个能让整封邮件放进预算的档位
+    for max_width, quality in IMAGE_LADDER:
+        layout = _ReportLayout(data_list, _encode_charts(data_list, max_width, quality), sections, reason, budget)
+        # 不含图片都已超预算时，继续降低画质也无济于事
+        if layout.estimate() <= budget or layout.estimate() - layout.image_bytes > budget: break
+
+    # 2. 仍超预算：逐步削减内容直到估计值不超预算
+    while layout.estimate() > budget and layout.shrink(): pass
+
+    # 3. 以实际报文体积兜底：估计偏差导致超出时继续削减
+    msg = layout.message(subject, sender, receiver)
+    while len(msg.as_bytes()) > budget and layout.shrink():
+        msg = layout.message(subject, sender, receiver)
+    return msg
@@ -0,0 +1,150 @@
+import os
+import pandas as pd
+import numpy as np
+from factor_engine import build_close_matrix, pool_cache_key
+
+# 协方差估计方法: sample / ewma / shrinkage
+COV_METHOD = os.environ.get('RISK_COV_METHOD', 'shrinkage')
+COV_WINDOW = 250         # 协方差估计使用的交易日数
+EWMA_LAMBDA = 0.94       # RiskMetrics 衰减因子
+PRICE_CORR_WINDOW = 60   # 配对交易用的价格相关性窗口 (与原 find_pair_opportunity 一致)
+VAR_Z_95 = 1.645
+
+# 按行情快照缓存，同一份行情内 pairs / 做市 / 动量 共用一次计算
+_RISK_CACHE = {}
+
+
+def sample_cov(returns):
+    return returns.cov().values
+
+
+def ewma_cov(returns, lam=EWMA_LAMBDA):
+    """指数加权协方差，越近的样本权重越大"""
+    x = returns.values - returns.values.mean(axis=0)
+    weights = lam ** np.arange(len(x))[::-1]
+    weights /= weights.sum()
+    return (x * weights[:, None]).T @ x
+
+
+def shrinkage_cov(returns):
+    """
+    Ledoit-Wolf 收缩估计：向样本方差构成的对角阵收缩，
+    收缩强度按解析公式估计，资产数接近样本数时比样本协方差稳定得多。
+    """
+    x = returns.values - returns.values.mean(axis=0)
+    t = len(x)
+    sample = x.T @ x / t
+    target = np.diag(np.diag(sample))
+    # pi: 样本协方差各元素估计误差之和；对角目标下 rho 只含对角线部分
+    pi_mat = (x ** 2).T @ (x ** 2) / t - sample ** 2
+    pi_hat = pi_mat.sum()
+    rho_hat = np.trace(pi_mat)
+    gamma_hat = ((sample - target) ** 2).sum()
+    if gamma_hat == 0: return sample
+    delta = max(0.0, min(1.0, (pi_hat - rho_hat) / gamma_hat / t))
+    return delta * target + (1 - delta) * sample
+
+
+COV_ESTIMATORS = {
+    'sample': sample_cov,
+    'ewma': ewma_cov,
+    'shrinkage': shrinkage_cov,
+}
+
+
+class RiskModel:
+    def __init__(self, df_dict, method=COV_METHOD):
+        """
+        :param df_dict: 与 QuantEngine 相同的 {symbol: DataFrame}
+        :param method: 协方差估计方法，见 COV_ESTIMATORS
+        """
+        raw = build_close_matrix(df_dict, ffill=False)
+        self.closes = raw.ffill()
+        # 收益率按各自交易日历计算：非交易日置为 NaN，而不是记作 0 收益
+        self.returns = self.closes.pct_change(fill_method=None).where(raw.notna())
+        self.symbols = list(self.closes.columns)
+        self.method = method
+
+        # 1. 单标的波动率：全样本一次算好，近 N 日按窗口惰性计算并缓存
+        self.vol_full = self.returns.std()
+        self._window_vols = {}
+
+        # 2. 配对交易用的价格相关矩阵
+        self.price_corr = self.closes.iloc[-PRICE_CORR_WINDOW:].corr(min_periods=PRICE_CORR_WINDOW)
+
+        # 3. 收益率协方差 (非交易日视为 0 收益，保证矩阵满秩可比)
+        window = self.returns.iloc[-COV_WINDOW:].dropna(axis=1, how='all').fillna(0.0)
+        self.cov_symbols = list(window.columns)
+        if len(window) > 1 and self.cov_symbols:
+            estimator = COV_ESTIMATORS.get(method, shrinkage_cov)
+            self.cov = pd.DataFrame(estimator(window), index=self.cov_symbols, columns=self.cov_symbols)
+        else:
+            self.cov = pd.DataFrame()
+        self._cov_returns = window
+
+    def window_vol(self, window):
+        """所有标的近 window 个自身交易日的收益率标准差；样本不足 window 个为 NaN"""
+        if window < 2: raise ValueError(f"波动率窗口至少为 2: {window}")
+        if window not in self._window_vols:
+            self._window_vols[window] = self.returns.apply(
+                lambda col: col.dropna().iloc[-window:].std() if col.count() >= window else np.nan
+            )
+        return self._window_vols[window]
+
+    def vol(self, symbol, window=None):
+        """日化波动率；window 为 None 时为全样本，否则为近 window 个交易日"""
+        source = self.vol_full if window is None else self.window_vol(window)
+        v = source.get(symbol, np.nan)
+        return None if pd.isna(v) else float(v)
+
+    def correlation(self, a, b):
+        """两标的收益率相关系数 (基于协方差矩阵)"""
+        if a not in self.cov.index or b not in self.cov.index: return None
+        denom = np.sqrt(self.cov.at[a, a] * self.cov.at[b, b])
+        return None if denom == 0 else float(self.cov.at[a, b] / denom)
+
+    def best_price_pair(self, symbol):
+        """价格相关性绝对值最高的对家，返回 (symbol, corr)"""
+        if symbol not in self.price_corr.index: return None, 0
+        row = self.price_corr[symbol].drop(symbol).dropna()
+        if row.empty: return None, 0
+        best = row.abs().idxmax()
+        return best, float(row[best])
+
+    def portfolio_risk(self, weights=None):
+        """
+        组合层面日度风险，默认等权持有整个资产池
+        :return: 波动率、参数法/历史法 95% VaR、各标的风险贡献
+        """
+        if self.cov.empty: return None
+        if weights is None:
+            w = pd.Series(1.0 / len(self.cov_symbols), index=self.cov_symbols)
+        else:
+            w = pd.Series(weights, dtype=float).reindex(self.cov_symbols).fillna(0.0)
+            if w.abs().sum() == 0: return None
+        sigma = self.cov.values
+        port_var = float(w.values @ sigma @ w.values)
+        port_vol = np.sqrt(max(port_var, 0.0))
+        # 风险贡献: w_i * (Σw)_i / σ_p，合计等于组合波动率
+        contrib = pd.Series(w.values * (sigma @ w.values) / port_vol if port_vol else 0.0, index=self.cov_symbols)
+        hist_returns = self._cov_returns.values @ w.values
+        corr = self.cov.values / np.sqrt(np.outer(np.diag(sigma), np.diag(sigma)))
+        off_diag = corr[~np.eye(len(corr), dtype=bool)]
+        return {
+            "method": self.method,
+            "volatility": port_vol,
+            "var_95_param": VAR_Z_95 * port_vol,
+            "var_95_hist": float(-np.percentile(hist_returns, 5)) if len(hist_returns) else np.nan,
+            "avg_correlation": float(np.nanmean(off_diag)) if off_diag.size else np.nan,
+            "contributions": contrib.sort_values(ascending=False),
+        }
+
+
+def get_risk_model(df_dict):
+    """带缓存的入口：同一份行情只估计一次"""
+    key, pool = pool_cache_key(df_dict)
+    if key is None: return None
+    if key not in _RISK_CACHE:
+        _RISK_CACHE.clear()
+        _RISK_CACHE[key] = RiskModel(pool)
+    return _RISK_CACHE[key]
@@ -0,0 +1,72 @@
+import os
+import time
+from contextlib import contextmanager
+
+# 单次运行的全局时间预算 (秒)
+# cron 每 20 分钟一次，留出 5 分钟给 commit/push quant_state.db，避免与下一次运行的 pull --rebase 冲突
+RUN_BUDGET_SECONDS = float(os.environ.get('RUN_BUDGET_SECONDS', 15 * 60))
+
+# 发送报告 / 写库的保底时间，昂贵阶段不得占用
+RESERVE_SECONDS = 30
+
+# 各昂贵阶段的初始耗时估计 (秒)，运行中按实测耗时修正
+STAGE_COST_ESTIMATES = {
+    'chart': 5.0,   # yfinance 拉取 + mplfinance 绘图
+    'news': 10.0,   # Google News RSS (requests timeout=10)
+    'llm': 30.0,    # OpenAI 客户端 timeout=30
+}
+
+STAGE_LABELS = {
+    'chart': '图表',
+    'news': '新闻',
+    'llm': 'AI解读',
+}
+
+
+class RunScheduler:
+    def __init__(self, budget_seconds=RUN_BUDGET_SECONDS, reserve_seconds=RESERVE_SECONDS, clock=time.monotonic):
+        """
+        :param budget_seconds: 本次运行的总时间预算
+        :param reserve_seconds: 为发送报告预留的时间
+        :param clock: 单调时钟，便于测试时注入
+        """
+        self.clock = clock
+        self.started_at = clock()
+        self.deadline = self.started_at + budget_seconds
+        self.reserve = reserve_seconds
+        self.costs = dict(STAGE_COST_ESTIMATES)
+
+    def remaining(self):
+        return self.deadline - self.clock()
+
+    def expired(self):
+        return self.remaining() <= self.reserve
+
+    def can_afford(self, *stages):
+        """预计耗时 + 保底时间 是否仍在截止时间之内"""
+        needed = sum(self.costs.get(s, 0.0) for s in stages)
+        return self.remaining() - self.reserve >= needed
+
+    @contextmanager
+    def track(self, stage):
+        """记录阶段实际耗时，取 max(估计, 实测) 的平滑值，慢的时候更保守"""
+        start = self.clock()
+        try:
+            yield
+        finally:
+            elapsed = self.clock() - start
+            prev = self.costs.get(stage, elapsed)
+            self.costs[stage] = max(elapsed, 0.5 * prev + 0.5 * elapsed)
+
+    @staticmethod
+    def priority_key(data):
+        """异动等级 > 异动分数 > 动量绝对值，均为降序"""
+        quant = data.get('quant_analysis') or {}
+        momentum = quant.get('momentum') or 0
+        return (-data.get('level', 0), -data.get('score', 0.0), -abs(momentum))
+
+    def prioritize(self, data_list):
+        return sorted(data_list, key=self.priority_key)
+
+    def summary(self):
+        return f"耗时 {self.clock() - self.started_at:.0f}s / 预算 {self.deadline - self.started_at:.0f}s"
@@ -1,6 +1,15 @@
 import pandas as pd
 import numpy as np
 
+# 左右侧信号动作的整数编码 (正为看多，负为看空)，用于历史快照的紧凑存储
+SIGNAL_SCORES = {
+    "强力买入": 2, "追涨": 2,
+    "买入": 1, "加仓": 1,
+    "持有": 0,
+    "卖出": -1, "离场": -1,
+    "强力卖出": -2, "清仓": -2,
+}
+
 class TechnicalAnalyzer:
     def __init__(self, df):
         self.df = df.copy()